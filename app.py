@@ -0,0 +1,86 @@
+# FastAPI chat service for BillCut.
+#
+# Streamlit reruns the whole script per interaction; serving the Gemini
+# call from an async endpoint instead lets one Uvicorn worker keep many
+# LLM-bound requests in flight. Run with:
+#
+#     uvicorn app:app --host 0.0.0.0 --port 8000
+#
+# Point the Streamlit app at it by setting BILLCUT_API_URL.
+
+import os
+
+import google.generativeai as genai
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from google.api_core import exceptions as api_exceptions
+from pydantic import BaseModel
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from prompts import SYSTEM_PROMPT
+
+api_key = os.environ.get("GOOGLE_API_KEY")
+if not api_key:
+    raise RuntimeError("Please set the GOOGLE_API_KEY environment variable.")
+genai.configure(api_key=api_key)
+
+model = genai.GenerativeModel(
+    model_name="gemini-1.5-flash-8b",
+    system_instruction=SYSTEM_PROMPT
+)
+
+app = FastAPI(title="BillCut Chat API")
+
+# Transcript roles from the Streamlit client; Gemini calls the reply side "model".
+ROLE_MAP = {"assistant": "model"}
+
+# Appended as the final chunk when generation dies after the 200 has been
+# sent. Must match STREAM_ERROR_SENTINEL in billcut_chatbot.py.
+STREAM_ERROR_SENTINEL = "\x1e[billcut-stream-error]"
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    message: str
+    history: list[ChatMessage] = []
+
+
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(min=0.5, max=8),
+    retry=retry_if_exception_type(api_exceptions.ResourceExhausted),
+    reraise=True,
+)
+async def start_stream(contents):
+    return await model.generate_content_async(contents, stream=True)
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    contents = [
+        {"role": ROLE_MAP.get(message.role, "user"), "parts": [message.content]}
+        for message in request.history
+    ]
+    contents.append({"role": "user", "parts": [request.message]})
+    try:
+        response = await start_stream(contents)
+    except api_exceptions.ResourceExhausted:
+        raise HTTPException(status_code=429, detail="Rate limited — try again shortly.")
+
+    async def stream():
+        try:
+            async for chunk in response:
+                # Safety/recitation-blocked candidates arrive without parts;
+                # chunk.text raises on those.
+                if chunk.parts:
+                    yield chunk.text
+        except Exception:
+            # The 200 is already on the wire — flag the failure in-band so
+            # the client doesn't record a truncated reply as a success.
+            yield STREAM_ERROR_SENTINEL
+
+    return StreamingResponse(stream(), media_type="text/plain")
@@ -1,72 +1,356 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
 import streamlit as st
 import google.generativeai as genai
 import os
+from google.api_core import exceptions as api_exceptions
+from tenacity import retry, retry_if_exception, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from prompts import SYSTEM_PROMPT, faq_responses, detailed_followups, repeat_followups
 
 # --- API Key Loader ---
 def get_api_key():
     try:
-        return st.secrets["GOOGLE_API_KEY"]
-    except KeyError:
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
-            st.error("Please set the GOOGLE_API_KEY in Streamlit secrets or environment.")
-            return None
-        return api_key
+        api_key = st.secrets.get("GOOGLE_API_KEY")
+    except FileNotFoundError:
+        # No secrets.toml at all (typical local run).
+        api_key = None
+    api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        st.error("Please set the GOOGLE_API_KEY in Streamlit secrets or environment.")
+        return None
+    return api_key
 
 # --- Gemini Setup ---
-api_key = get_api_key()
-if api_key:
+@st.cache_resource(show_spinner=False)
+def configure_gemini(api_key):
     genai.configure(api_key=api_key)
-else:
+    return True
+
+# The key lookup stays outside the cache so a missing key is re-checked on
+# the next rerun; only successful configuration is memoized.
+api_key = get_api_key()
+if not api_key:
     st.stop()
+configure_gemini(api_key)
+
+# --- Logging ---
+logger = logging.getLogger("billcut")
+
+@st.cache_resource(show_spinner=False)
+def setup_logging():
+    # Emit through a queue so the error path never blocks on stdout flushes.
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.WARNING)
+    return listener
+
+setup_logging()
+
+# --- Model Factory ---
+@st.cache_resource(show_spinner=False)
+def get_model():
+    return genai.GenerativeModel(
+        model_name="gemini-1.5-flash-8b",
+        system_instruction=SYSTEM_PROMPT
+    )
+
+# --- Shared Event Loop ---
+@st.cache_resource(show_spinner=False)
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# --- Async Bridge ---
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# Absorb transient 429s with jittered backoff instead of failing the turn.
+retry_on_rate_limit = retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(min=0.5, max=8),
+    retry=retry_if_exception_type(api_exceptions.ResourceExhausted),
+    reraise=True,
+)
+
+@retry_on_rate_limit
+def open_stream(make_response_coro):
+    return run_async(make_response_coro())
+
+def iter_async_stream(make_response_coro):
+    loop = get_event_loop()
+    iterator = open_stream(make_response_coro).__aiter__()
+    while True:
+        try:
+            chunk = asyncio.run_coroutine_threadsafe(iterator.__anext__(), loop).result()
+        except StopAsyncIteration:
+            break
+        yield chunk.text
+
+# --- Context Budget ---
+MAX_CONTEXT_TOKENS = 900_000
+
+@st.cache_resource(show_spinner=False)
+def get_token_encoder():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+def estimate_tokens(text):
+    encoder = get_token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return max(1, len(text) // 4)
+
+def trim_chat_history(chat):
+    history = list(chat.history)
+    total = sum(estimate_tokens(part.text) for content in history for part in content.parts)
+    trimmed = False
+    # Drop whole user/model turn pairs from the front until under budget.
+    while len(history) > 2 and total > MAX_CONTEXT_TOKENS:
+        for dropped in history[:2]:
+            total -= sum(estimate_tokens(part.text) for part in dropped.parts)
+        del history[:2]
+        trimmed = True
+    if trimmed:
+        chat.history = history
+
+# --- Gemini Streaming ---
+API_URL = os.environ.get("BILLCUT_API_URL")
+
+# Must match STREAM_ERROR_SENTINEL in app.py.
+STREAM_ERROR_SENTINEL = "\x1e[billcut-stream-error]"
+
+def _is_http_rate_limit(exc):
+    import httpx
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429
+
+retry_on_http_rate_limit = retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(min=0.5, max=8),
+    retry=retry_if_exception(_is_http_rate_limit),
+    reraise=True,
+)
+
+@retry_on_http_rate_limit
+def open_api_stream(client, payload):
+    response = client.send(client.build_request("POST", f"{API_URL}/chat", json=payload), stream=True)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return response
+
+def stream_api_response(user_message):
+    import httpx
+    payload = {
+        "message": user_message,
+        # The current user message was appended to the transcript just
+        # before this call; everything before it is context.
+        "history": st.session_state.messages[:-1],
+    }
+    with httpx.Client(timeout=60.0) as client:
+        response = open_api_stream(client, payload)
+        try:
+            text = ""
+            for chunk in response.iter_text():
+                if not chunk:
+                    continue
+                text += chunk
+                if STREAM_ERROR_SENTINEL in text:
+                    raise RuntimeError("chat API reported a mid-stream error")
+                yield chunk
+            if not text:
+                raise RuntimeError("chat API returned an empty reply")
+        finally:
+            response.close()
+
+def stream_gemini_response(user_message):
+    if API_URL:
+        yield from stream_api_response(user_message)
+    else:
+        yield from iter_async_stream(lambda: get_model().generate_content_async(user_message, stream=True))
+
+def recover_chat(chat):
+    # A streamed reply that fails mid-iteration (or ends safety-blocked)
+    # leaves the session pointing at the broken response, and every later
+    # chat.history access raises. Probe for that state and drop the failed
+    # turn; a healthy session is left untouched.
+    try:
+        chat.history
+        return
+    except Exception:
+        pass
+    try:
+        chat.rewind()
+    except Exception:
+        chat._last_sent = None
+        chat._last_received = None
+
+def stream_chat_response(chat, user_message):
+    recover_chat(chat)
+    trim_chat_history(chat)
+    yield from iter_async_stream(lambda: chat.send_message_async(user_message, stream=True))
+
+def stream_turn_response(user_message):
+    # One conversational turn, context included: thin-client mode sends
+    # the transcript to the API, otherwise the session chat carries it.
+    if API_URL:
+        yield from stream_api_response(user_message)
+    else:
+        yield from stream_chat_response(st.session_state.chat, user_message)
+
+# --- Cached Gemini Lookup ---
+# Entries are keyed on the normalized message only; the raw message's
+# leading underscore excludes it from hashing, so casing variants share
+# one entry while the model still sees the message as typed.
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False, max_entries=1000)
+def get_gemini_response(normalized_message, _raw_message):
+    return "".join(stream_gemini_response(_raw_message))
 
-# --- System Prompt ---
-system_prompt = """
-You are Sophie, a helpful and friendly AI assistant for BillCut — a company that helps people in India get out of debt.
-
-Your tone is:
-- Friendly
-- Fun and a bit quirky
-- Supportive and to-the-point
-
-Your job:
-- Explain how BillCut helps with loans, EMIs, debt settlement, and money habits.
-- Use short, clear sentences.
-- Bring the conversation back to BillCut when possible.
-- Let the user lead — end the conversation naturally without forcing lines like “Want me to explain in detail?”
-- Always respond in the same language the user is using — English, Hindi or Hinglish.
-
-Never start replies with “Hi” or “Hey”.
-"""
-
-# --- Scripted Responses ---
-faq_responses = {
-    "what is billcut": "BillCut is a fintech company that does debt refinancing. Want to know more?",
-    "does billcut charge": "BillCut doesn’t charge any fees, except ₹19 for a session with our advisor during debt settlement.",
-    "interest rate": "The interest rate is usually between 12 to 19 percent.",
-    "multiple loans": "Yes! You can combine all your loans into one and pay directly via NBFC.",
-    "how does billcut pay": "BillCut works with NBFCs. They pay your loan amount directly.",
-    "will the funds come": "Yes! Funds come to your account — except in balance transfers, which use a demand draft.",
-    "foreclosure charge": "It's around 3% of the remaining amount.",
-    "credit score": "Nope! Your score won’t be affected — unless you go for debt settlement.",
-    "why work email": "Just to verify your job — we won’t send any mails there, promise!",
-    "what is demand draft": "It's like a prepaid cheque — but safer, and it can’t bounce.",
-    "what are nbfc": "NBFCs give loans like banks — but they’re not banks.",
-    "full form of nbfc": "NBFC stands for Non-Banking Financial Company.",
-    "how does billcut pay credit card": "BillCut pays your card via its lending partners."
-}
-
-# Longer follow-ups
-detailed_followups = {
-    "what is billcut": "BillCut helps refinance your debt through its lending partners — like converting credit card dues into EMIs. We also offer debt settlement.",
-    "how does billcut pay credit card": "BillCut pays your credit card bill by transferring funds to your account through its lending partners. The amount is converted into a low-interest EMI. You just show proof of payment for your credit card."
-}
-
-# Soft repeat fallback
-repeat_followups = {
-    "what is billcut": "To recap — BillCut can turn your high-interest loans into manageable EMIs. We even negotiate with banks. Want help with your own case?",
-    "how does billcut pay credit card": "Again — funds go from our partners to your account. You pay the card and repay in EMIs. Want to explore options?"
-}
+def is_context_free_turn():
+    # Just the greeting plus the message being answered: nothing for the
+    # reply to depend on, so it can be served from the cross-session memo.
+    return len(st.session_state.messages) == 2
+
+def record_chat_turn(chat, user_message, reply):
+    # Mirror an externally produced turn into the session chat so later
+    # follow-ups keep their context.
+    chat.history = list(chat.history) + [
+        {"role": "user", "parts": [user_message]},
+        {"role": "model", "parts": [reply]},
+    ]
+
+def rehydrate_chat(chat, messages):
+    # Rebuild the model-side context from a resumed transcript. The canned
+    # greeting leads every transcript and isn't model output, so it is
+    # skipped; the rest alternates user/assistant pairs.
+    history = [
+        {"role": "model" if msg["role"] == "assistant" else "user", "parts": [msg["content"]]}
+        for msg in messages[1:]
+    ]
+    if history:
+        chat.history = history
+
+# --- Local Model Routing ---
+LOCAL_ESCALATE_TOKEN = "ESCALATE"
+
+@st.cache_resource(show_spinner=False)
+def get_local_model():
+    model_path = os.environ.get("BILLCUT_LOCAL_MODEL")
+    if not model_path:
+        return None
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        return None
+    return Llama(model_path=model_path, n_ctx=2048, verbose=False)
+
+def get_local_response(user_message):
+    llm = get_local_model()
+    if llm is None:
+        return None
+    prompt = (
+        f"{SYSTEM_PROMPT}\n"
+        f"If you are not confident you can answer from the facts above, reply with exactly {LOCAL_ESCALATE_TOKEN}.\n\n"
+        f"User: {user_message}\nSophie:"
+    )
+    try:
+        output = llm(prompt, max_tokens=256, temperature=0.2, stop=["User:"])
+    except Exception:
+        logger.exception("Local model error")
+        return None
+    text = output["choices"][0]["text"].strip()
+    if not text or LOCAL_ESCALATE_TOKEN in text:
+        return None
+    return text
+
+# --- Session Persistence ---
+SESSION_DIR = Path(".billcut_sessions")
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+
+def get_session_token():
+    # Streamlit's session_id changes on every reconnect, so transcripts are
+    # keyed on a token carried in the URL instead: it survives refreshes
+    # and server restarts, which is when resuming actually matters.
+    token = st.query_params.get("sid", "")
+    if not re.fullmatch(r"[0-9a-f]{32}", token):
+        token = uuid.uuid4().hex
+        st.query_params["sid"] = token
+    return token
+
+@st.cache_resource(show_spinner=False)
+def prune_stale_sessions():
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    try:
+        for path in SESSION_DIR.glob("*.json"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return True
+
+def persist_messages():
+    try:
+        SESSION_DIR.mkdir(exist_ok=True)
+        path = SESSION_DIR / f"{get_session_token()}.json"
+        path.write_text(json.dumps(st.session_state.messages, ensure_ascii=False))
+    except OSError:
+        pass
+
+def resume_messages():
+    prune_stale_sessions()
+    path = SESSION_DIR / f"{get_session_token()}.json"
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+# --- Semantic FAQ Matching ---
+FAQ_MATCH_THRESHOLD = 0.75
+
+@st.cache_resource(show_spinner=False)
+def get_faq_index():
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+    encoder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    keys = list(faq_responses)
+    embeddings = encoder.encode(keys, normalize_embeddings=True)
+    return encoder, keys, embeddings
+
+def match_faq(user_message):
+    index = get_faq_index()
+    if index is None:
+        for key in faq_responses:
+            if key in user_message:
+                return key
+        return None
+    encoder, keys, embeddings = index
+    query = encoder.encode([user_message], normalize_embeddings=True)[0]
+    scores = embeddings @ query
+    best = scores.argmax()
+    if scores[best] >= FAQ_MATCH_THRESHOLD:
+        return keys[best]
+    return None
 
 # --- Streamlit App UI ---
 st.title("👋 Hi, how can I help you today?")
@@ -74,14 +358,13 @@ st.caption("talk to me in whatever language you like: english, hindi or a mixtur
 
 # --- Session State ---
 if "chat" not in st.session_state:
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash-8b",
-        system_instruction=system_prompt
-    )
-    st.session_state.chat = model.start_chat(history=[])
+    st.session_state.chat = get_model().start_chat(history=[])
 
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hello! How can I help you with BillCut today?"}]
+    resumed = resume_messages()
+    st.session_state.messages = resumed or [{"role": "assistant", "content": "Hello! How can I help you with BillCut today?"}]
+    if resumed:
+        rehydrate_chat(st.session_state.chat, resumed)
 
 if "last_question_key" not in st.session_state:
     st.session_state.last_question_key = None
@@ -93,61 +376,98 @@ if "followup_count" not in st.session_state:
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
+st.session_state.rendered_count = len(st.session_state.messages)
 
 # --- Chat Input Logic ---
-if user_input := st.chat_input("Ask me anything about BillCut..."):
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    with st.chat_message("user"):
-        st.markdown(user_input)
-
-    input_lower = user_input.lower().strip()
-    response = None
-
-    if input_lower in ["yes", "yeah", "sure", "ok", "okay"]:
-        key = st.session_state.last_question_key
-        count = st.session_state.followup_count
-
-        if key:
-            if count == 0 and key in detailed_followups:
-                response = detailed_followups[key]
-                st.session_state.followup_count += 1
-            elif count == 1 and key in repeat_followups:
-                response = repeat_followups[key]
-                st.session_state.followup_count += 1
+# Runs as a fragment: a submitted message reruns only this block, not the
+# full script. Messages appended by earlier fragment runs are replayed
+# from rendered_count onward, so that span grows turn by turn until a
+# full rerun folds it back into the main history pass; once it exceeds
+# FRAGMENT_REPLAY_LIMIT one is forced, keeping per-turn replay bounded.
+FRAGMENT_REPLAY_LIMIT = 20
+
+@st.fragment
+def chat_turn():
+    for msg in st.session_state.messages[st.session_state.rendered_count:]:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+    if user_input := st.chat_input("Ask me anything about BillCut..."):
+        st.session_state.messages.append({"role": "user", "content": user_input})
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        input_lower = user_input.lower().strip()
+        response = None
+        streamed = False
+
+        if input_lower in ["yes", "yeah", "sure", "ok", "okay"]:
+            key = st.session_state.last_question_key
+            count = st.session_state.followup_count
+
+            if key:
+                if count == 0 and key in detailed_followups:
+                    response = detailed_followups[key]
+                    st.session_state.followup_count += 1
+                elif count == 1 and key in repeat_followups:
+                    response = repeat_followups[key]
+                    st.session_state.followup_count += 1
+                else:
+                    try:
+                        with st.chat_message("assistant"):
+                            response = st.write_stream(stream_turn_response(user_input))
+                        streamed = True
+                    except Exception:
+                        logger.exception("Gemini error")
+                        recover_chat(st.session_state.chat)
+                        response = "Oops! Something went wrong. Try again?"
             else:
                 try:
-                    response = st.session_state.chat.send_message(user_input).text
-                except Exception as e:
+                    with st.chat_message("assistant"):
+                        response = st.write_stream(stream_turn_response(user_input))
+                    streamed = True
+                except Exception:
+                    logger.exception("Gemini error")
+                    recover_chat(st.session_state.chat)
                     response = "Oops! Something went wrong. Try again?"
-                    print("Gemini error:", e)
-        else:
-            try:
-                response = st.session_state.chat.send_message(user_input).text
-            except Exception as e:
-                response = "Oops! Something went wrong. Try again?"
-                print("Gemini error:", e)
 
-    else:
-        match = None
-        for key in faq_responses:
-            if key in input_lower:
-                match = key
-                break
-
-        if match:
-            response = faq_responses[match]
-            st.session_state.last_question_key = match
-            st.session_state.followup_count = 0
         else:
-            try:
-                response = st.session_state.chat.send_message(user_input).text
-            except Exception as e:
-                response = "Oops! Something went wrong. Try again?"
-                print("Gemini error:", e)
-            st.session_state.last_question_key = None
-            st.session_state.followup_count = 0
-
-    # Display response
-    st.session_state.messages.append({"role": "assistant", "content": response})
-    with st.chat_message("assistant"):
-        st.markdown(response)
+            match = match_faq(input_lower)
+
+            if match:
+                response = faq_responses[match]
+                st.session_state.last_question_key = match
+                st.session_state.followup_count = 0
+            else:
+                response = get_local_response(user_input)
+                if response is not None and not API_URL:
+                    record_chat_turn(st.session_state.chat, user_input, response)
+                if response is None:
+                    try:
+                        with st.chat_message("assistant"):
+                            if is_context_free_turn():
+                                response = get_gemini_response(input_lower, user_input)
+                                st.markdown(response)
+                                if not API_URL:
+                                    record_chat_turn(st.session_state.chat, user_input, response)
+                            else:
+                                response = st.write_stream(stream_turn_response(user_input))
+                        streamed = True
+                    except Exception:
+                        logger.exception("Gemini error")
+                        recover_chat(st.session_state.chat)
+                        response = "Oops! Something went wrong. Try again?"
+                st.session_state.last_question_key = None
+                st.session_state.followup_count = 0
+
+        # Display response
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        persist_messages()
+        if not streamed:
+            with st.chat_message("assistant"):
+                st.markdown(response)
+
+        if len(st.session_state.messages) - st.session_state.rendered_count >= FRAGMENT_REPLAY_LIMIT:
+            st.rerun()
+
+chat_turn()